@@ -1,13 +1,54 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Optional, Callable, Dict, Any
 from datetime import datetime
+from urllib.parse import urljoin
 import logging
-import pickle
+import atexit
+import functools
+import io
 import os
 import re
+import time
+import weakref
 from lxml import etree
 
 from models.post import ForumPost
+from utils import THREAD_ID_RE, json_dumps, json_loads
+
+# 预编译的 XPath 表达式
+_XP_NAV_TEXT = etree.XPath('//section[@id="nav-additional"]//text()')
+_XP_TITLE = etree.XPath('.//th[@class="common"]/a')
+_XP_AUTHOR = etree.XPath('.//td[@class="by"]/cite/a/text()')
+_XP_POSTS = etree.XPath('//div[@id="postlist"]/div[starts-with(@id, "post_")]')
+_XP_SUBJECT = etree.XPath('//a[@id="thread_subject"]')
+_XP_POST_AUTHOR = etree.XPath('.//td[@class="pls"]//a[@class="xw1"]')
+_XP_POSTTIME = etree.XPath('.//em[@id=$eid]/span/@title')
+_XP_POSTMESSAGE = etree.XPath('.//td[@id=$tid]')
+_XP_IMGS = etree.XPath('.//img')
+_XP_TAGS = etree.XPath('.//span[@class="tag"] | .//a[contains(@class, "tag")]')
+_XP_STEAM_LINKS = etree.XPath('.//a[contains(@href, "steam") or contains(@href, "steamdb")]')
+
+# 帖子内容中需要跳过的容器类名
+_SKIP_CLASSES = frozenset({'swi-block', 'steam-info-wrapper', 'tip', 'steam-info-loading', 'original_text_style1'})
+_DIV_SKIP_CLASSES = _SKIP_CLASSES | {'rnd_ai_pr'}
+
+# 登录页面表单参数
+_FORMHASH_RE = re.compile(rb'name="formhash"\s+value="([0-9a-zA-Z]+)"')
+_LOGINHASH_RE = re.compile(rb'<form[^>]+name="login"[^>]+id="[^"]*_([0-9a-zA-Z]+)"')
+
+# Steam 链接与倒计时组件识别
+_STEAM_RE = re.compile(r'steam', re.IGNORECASE)
+_COUNTDOWN_RE = re.compile(r'countdown(?:.*?[?&]t=(\d+))?', re.IGNORECASE)
+
+# 帖子内容清理
+_MULTI_NL_RE = re.compile(r'\n\s*\n')
+_MULTI_SP_RE = re.compile(r' {2,}')
+_ZERO_WIDTH_TABLE = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff'))
+
+# 元素处理结果：继续深入子树 / 已处理不再深入 / 连同尾部文本一起跳过
+_DESCEND, _LEAF, _DROP = range(3)
 
 class ForumLoginException(Exception):
     """论坛登录异常"""
@@ -19,9 +60,285 @@ class CaptchaRequiredException(Exception):
         self.captcha_image = captcha_image
         super().__init__(message)
 
+class _MessageParser:
+    """帖子内容解析器，将帖子正文转换为 Telegram 消息文本"""
+    
+    __slots__ = ('absurl', 'logger', 'parts', 'skip_next_steam_span')
+    
+    def __init__(self, absurl: Callable[[str], str], logger: logging.Logger):
+        self.absurl = absurl
+        self.logger = logger
+        self.parts: list[str] = []
+        self.skip_next_steam_span = False  # 添加标志来跳过Steam相关的span
+    
+    def parse(self, root: etree._Element) -> str:
+        """解析帖子内容为字符串"""
+        parts = self.parts
+        handlers = self._HANDLERS
+        
+        # 单次迭代遍历整棵树：start 事件处理元素本身，end 事件处理尾部文本
+        dropped = None
+        walker = etree.iterwalk(root, events=('start', 'end'))
+        for event, element in walker:
+            if element is root:
+                if event == 'start':
+                    self._append_text(element.text)
+                continue
+            
+            if event == 'start':
+                handler = handlers.get(element.tag.lower())
+                action = handler(self, element) if handler else _DESCEND
+                if action == _DESCEND:
+                    self._append_text(element.text)
+                else:
+                    # 已处理或需要跳过的元素不再深入子树
+                    walker.skip_subtree()
+                    if action == _DROP:
+                        dropped = element
+                continue
+            
+            # 被跳过的元素连同尾部文本一起丢弃
+            if element is dropped:
+                dropped = None
+                continue
+            
+            # 处理尾部文本
+            if element.tail:
+                tail_text = element.tail.strip()
+                if tail_text:
+                    if parts and parts[-1].startswith('['):
+                        parts[-1] += '\n'
+                    parts.append(tail_text)
+        
+        if len(parts) > 1 and '[图片]' in parts[0] and '[Steam' in parts[1]:
+            parts = parts[1:]  # 如果第一个是图片，跳过
+        
+        # 合并内容并清理，仅在前一段不以空白结尾时插入空格
+        buffer = io.StringIO()
+        length = 0
+        last_was_ws = True
+        for part in parts:
+            if not last_was_ws and not part[:1].isspace():
+                buffer.write(' ')
+                length += 1
+            buffer.write(part)
+            length += len(part)
+            last_was_ws = part[-1:].isspace()
+            if length > 2000:
+                buffer.write('...')
+                break
+        
+        # 清理零宽字符和多余的空白字符
+        content = buffer.getvalue().translate(_ZERO_WIDTH_TABLE)
+        content = _MULTI_NL_RE.sub('\n', content)  # 合并多个空行
+        content = _MULTI_SP_RE.sub(' ', content)  # 合并多个空格
+        return content.strip()
+    
+    def _append_text(self, text: Optional[str]):
+        """处理文本内容，与上一段普通文本合并"""
+        if not text:
+            return
+        text = text.strip()
+        if not text:
+            return
+        parts = self.parts
+        if parts and not parts[-1].startswith(('[', 'http', '*', '>', '\n')):
+            parts[-1] += text
+            if len(parts[-1]) > 50:
+                parts[-1] = parts[-1][:50] + '...'
+        else:
+            parts.append(text)
+    
+    def _extract_text_content(self, element: etree._Element) -> str:
+        """提取元素的纯文本内容"""
+        return ' '.join(text for text in map(str.strip, element.itertext()) if text)
+    
+    def _handle_img(self, child: etree._Element) -> int:
+        # 处理图片
+        src = child.get('file', '')
+        if src and not src.startswith('data:'):
+            # 确保URL完整
+            src = self.absurl(src)
+            self.parts.append(f"[图片]({src})")
+        return _LEAF
+    
+    def _handle_a(self, child: etree._Element) -> int:
+        # 处理链接
+        href = child.get('href', '')
+        link_text = child.text or ''
+        parts = self.parts
+        
+        if href.endswith('.jpg') or href.endswith('.png') or href.endswith('.gif'):
+            # 如果链接是图片，直接添加
+            parts.append(f"[图片]({href})")
+        if _STEAM_RE.search(href):
+            # Steam相关链接特殊处理
+            if link_text:
+                parts.append(f"[{link_text}]({href})")
+            else:
+                parts.append(f"[Steam链接]({href})")
+        elif href.startswith('#'):
+            # 页面内锚点链接，只保留文本
+            if link_text:
+                parts.append(link_text)
+        elif href and link_text:
+            if 'javascript:' in href:
+                # 跳过JavaScript链接
+                return _DROP
+            # 确保URL完整
+            href = self.absurl(href)
+            if (link_text[:5] == href[:5] and link_text[-5:] == href[-5:]):
+                # 如果链接文本和URL相同，直接使用文本
+                parts.append(link_text)
+            else:
+                parts.append(f"[{link_text}]({href})")
+        elif link_text:
+            parts.append(link_text)
+        return _LEAF
+    
+    def _handle_iframe(self, child: etree._Element) -> int:
+        # 处理iframe（如Steam小部件）
+        src = child.get('src', '')
+        class_attr = child.get('class', '')
+        parts = self.parts
+        if _STEAM_RE.search(src): # https://store.steampowered.com/widget/3289890/?utm_source=keylol
+            if ('widget' in src): # https://store.steampowered.com/widget/3588970/?utm_source=keylol&cc=cn
+                src = src.replace('widget', 'app')
+            if 'app/' in src:
+                app_id = src.split('app/')[-1].split('/?')[0]
+                parts.append(f"[Steam app {app_id}](https://store.steampowered.com/app/{app_id})")
+            else:
+                parts.append(f"[Steam链接]({src})")
+            # 设置标志，跳过下一个Steam相关的span
+            self.skip_next_steam_span = True
+        elif countdown := _COUNTDOWN_RE.search(src):
+            if countdown.group(1):
+                local_time = datetime.fromtimestamp(int(countdown.group(1)))
+                parts.append(f"[倒计时: {local_time.strftime('%Y-%m-%d %H:%M:%S')}]")
+        else:
+            if class_attr == 'html5video':
+                if 'bilibili' in src:
+                    bvid = src.split('?bvid=')[-1].split('&')[0]
+                    parts.append(f"[{bvid}](https://www.bilibili.com/video/{bvid}/)")
+                elif 'mp4=' in src:
+                    src = src.split('mp4=')[-1]
+                    parts.append(f"[视频]({src})")
+            else:
+                parts.append("[嵌入内容]")
+        return _LEAF
+    
+    def _handle_heading(self, child: etree._Element) -> int:
+        # 处理标题
+        title_text = self._extract_text_content(child)
+        if title_text:
+            self.parts.append(f"\n**{title_text}**\n")
+        return _LEAF
+    
+    def _handle_blockquote(self, child: etree._Element) -> int:
+        # 处理引用
+        quote_text = self._extract_text_content(child)
+        if quote_text:
+            # 为引用添加前缀
+            quote_header = "**" if len(quote_text) >  50 else ""
+            quoted_lines = [f"{quote_header}> {line}" for line in quote_text.split('\n') if line.strip()]
+            self.parts.append('\n' + '\n'.join(quoted_lines) + '\n')
+        return _LEAF
+    
+    def _handle_br(self, child: etree._Element) -> int:
+        # 处理换行
+        parts = self.parts
+        if parts and not parts[-1].endswith('\n'):
+            parts[-1] += '' if parts[-1].startswith('[') else '\n'
+        return _LEAF
+    
+    def _handle_span(self, child: etree._Element) -> int:
+        # 检查是否需要跳过Steam相关的span
+        style_attr = child.get('style', '')
+        
+        # 检查是否是Steam小部件后的相关span（通过样式特征识别）
+        if self.skip_next_steam_span and ('font-size: 10px' in style_attr or 'overflow: visible' in style_attr):
+            # 检查span内容是否包含Steam相关链接
+            span_text = self._extract_text_content(child)
+            steam_links = _XP_STEAM_LINKS(child)
+            
+            if steam_links or _STEAM_RE.search(span_text):
+                # 跳过这个Steam相关的span
+                self.skip_next_steam_span = False  # 重置标志
+                return _DROP
+        
+        # 跳过某些不需要的元素
+        class_attr = child.get('class', '')
+        if not _SKIP_CLASSES.isdisjoint(class_attr.split()):
+            return _DROP
+        
+        # 递归处理子元素
+        return _DESCEND
+    
+    def _handle_div(self, child: etree._Element) -> int:
+        # 处理一般容器元素
+        class_attr = child.get('class', '')
+        
+        # 跳过某些不需要的元素
+        if not _DIV_SKIP_CLASSES.isdisjoint(class_attr.split()):
+            return _DROP
+        
+        if class_attr == 'locked':
+            self.parts.append("[隐藏内容]")
+            return _DROP
+        
+        # 递归处理子元素
+        return _DESCEND
+    
+    def _handle_bold(self, child: etree._Element) -> int:
+        # 处理粗体
+        bold_text = self._extract_text_content(child)
+        if bold_text:
+            self.parts.append(f"**{bold_text}**")
+        return _LEAF
+    
+    def _handle_italic(self, child: etree._Element) -> int:
+        # 处理斜体
+        if '本帖最后由' not in (child.text or ''):
+            italic_text = self._extract_text_content(child)
+            if italic_text:
+                self.parts.append(f"*{italic_text}*")
+        return _LEAF
+    
+    def _handle_paragraph(self, child: etree._Element) -> int:
+        # 处理段落，无直接文本时按普通容器递归
+        if not child.text:
+            return _DESCEND
+        para_text = self._extract_text_content(child)
+        if para_text:
+            self.parts.append(f"\n{para_text}\n")
+        return _LEAF
+    
+    def _handle_skip(self, child: etree._Element) -> int:
+        # 跳过脚本和样式元素
+        return _DROP
+    
+    _HANDLERS = {
+        'img': _handle_img,
+        'a': _handle_a,
+        'iframe': _handle_iframe,
+        'h1': _handle_heading, 'h2': _handle_heading, 'h3': _handle_heading,
+        'h4': _handle_heading, 'h5': _handle_heading, 'h6': _handle_heading,
+        'blockquote': _handle_blockquote,
+        'br': _handle_br,
+        'span': _handle_span,
+        'div': _handle_div,
+        'strong': _handle_bold, 'b': _handle_bold,
+        'em': _handle_italic, 'i': _handle_italic,
+        'p': _handle_paragraph,
+        'script': _handle_skip, 'noscript': _handle_skip, 'style': _handle_skip,
+    }
+
 class ForumClient:
     """论坛客户端"""
     
+    # 登录状态检查结果的缓存时间（秒）
+    LOGIN_CHECK_TTL = 30
+    
     def __init__(self, base_url: str, username: str, password: str, session_file: Optional[str] = None, work_dir: Optional[str] = None):
         self.base_url = base_url.rstrip('/')
         self.username = username
@@ -29,10 +346,40 @@ class ForumClient:
         self.session = requests.Session()
         self.is_logged_in = False
         self.logger = logging.getLogger(__name__)
+        self._atexit_registered = False
+        self._login_checked_at = 0.0
+        
+        # 帖子列表的条件请求缓存
+        self._listing_etag: Optional[str] = None
+        self._listing_lastmod: Optional[str] = None
+        self._listing_cache: Optional[List[ForumPost]] = None
+        
+        # 将站内相对链接补全为绝对地址
+        self._absurl = functools.partial(urljoin, self.base_url + '/')
+        
+        # 复用连接池，并对网关错误自动重试
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            # 重试用尽后仍返回最后的响应，交给原有的状态码判断处理
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                              raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # 复用的 HTML 解析器，去掉代码中不会用到的注释、处理指令和 ID 索引
+        self._parser = etree.HTMLParser(
+            recover=True,
+            encoding='utf-8',
+            remove_comments=True,
+            remove_pis=True,
+            collect_ids=False
+        )
         
         # 设置 session 文件路径
         if session_file is None:
-            self.session_file = f"forum_session_{username}.pkl"
+            self.session_file = f"forum_session_{username}.json"
         else:
             self.session_file = session_file
         if work_dir is not None:
@@ -40,7 +387,8 @@ class ForumClient:
         
         # 设置请求头
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36',
+            'Connection': 'keep-alive'
         })
         
         # 尝试加载已保存的 session
@@ -50,13 +398,13 @@ class ForumClient:
         """保存 session 到文件"""
         try:
             session_data = {
-                'cookies': self.session.cookies.get_dict(),
+                'cookies': requests.utils.dict_from_cookiejar(self.session.cookies),
                 'headers': dict(self.session.headers),
                 'is_logged_in': self.is_logged_in
             }
             
             with open(self.session_file, 'wb') as f:
-                pickle.dump(session_data, f)
+                f.write(json_dumps(session_data))
             
             self.logger.info(f"Session 已保存到 {self.session_file}")
         except Exception as e:
@@ -65,16 +413,17 @@ class ForumClient:
     def _load_session(self):
         """从文件加载 session"""
         try:
+            self._migrate_legacy_session()
+            
             if not os.path.exists(self.session_file):
                 self.logger.info("Session 文件不存在，将创建新的 session")
                 return
             
             with open(self.session_file, 'rb') as f:
-                session_data = pickle.load(f)
+                session_data = json_loads(f.read())
             
             # 恢复 cookies
-            for name, value in session_data.get('cookies', {}).items():
-                self.session.cookies.set(name, value)
+            requests.utils.add_dict_to_cookiejar(self.session.cookies, session_data.get('cookies', {}))
             
             # 恢复登录状态
             self.is_logged_in = session_data.get('is_logged_in', False)
@@ -90,6 +439,31 @@ class ForumClient:
             self.logger.error(f"加载 session 失败: {e}")
             self.is_logged_in = False
     
+    def _migrate_legacy_session(self):
+        """将旧版 pickle 格式的 session 文件迁移为 JSON"""
+        legacy_file = os.path.splitext(self.session_file)[0] + '.pkl'
+        if legacy_file == self.session_file or not os.path.exists(legacy_file):
+            return
+        if os.path.exists(self.session_file):
+            os.remove(legacy_file)
+            return
+        
+        import pickle
+        
+        try:
+            with open(legacy_file, 'rb') as f:
+                session_data = pickle.load(f)
+            with open(self.session_file, 'wb') as f:
+                f.write(json_dumps({
+                    'cookies': dict(session_data.get('cookies', {})),
+                    'headers': dict(session_data.get('headers', {})),
+                    'is_logged_in': bool(session_data.get('is_logged_in', False))
+                }))
+            os.remove(legacy_file)
+            self.logger.info(f"旧版 session 已迁移到 {self.session_file}")
+        except Exception as e:
+            self.logger.error(f"迁移旧版 session 失败: {e}")
+    
     def clear_session(self):
         """清除 session 文件"""
         try:
@@ -97,6 +471,8 @@ class ForumClient:
                 os.remove(self.session_file)
                 self.logger.info("Session 文件已清除")
             self.is_logged_in = False
+            self._login_checked_at = 0.0
+            self._listing_cache = None
         except Exception as e:
             self.logger.error(f"清除 session 失败: {e}")
     
@@ -113,11 +489,18 @@ class ForumClient:
             if login_page.status_code != 200:
                 raise ForumLoginException("无法访问登录页面")
 
-            # 解析登录页面
-            tree = etree.HTML(login_page.content, parser=etree.HTMLParser())
-            form = tree.xpath('//form[@name="login"]')[0]
-            loginhash = form.xpath('./@id')[0].split('_')[-1]
-            formhash = form.xpath('.//input[@name="formhash"]/@value')[0]
+            # 直接从原始字节中提取表单参数，失败时再完整解析登录页面
+            body = login_page.content
+            formhash_match = _FORMHASH_RE.search(body)
+            loginhash_match = _LOGINHASH_RE.search(body)
+            if formhash_match and loginhash_match:
+                formhash = formhash_match.group(1).decode('ascii')
+                loginhash = loginhash_match.group(1).decode('ascii')
+            else:
+                tree = etree.fromstring(body, self._parser)
+                form = tree.xpath('//form[@name="login"]')[0]
+                loginhash = form.xpath('./@id')[0].split('_')[-1]
+                formhash = form.xpath('.//input[@name="formhash"]/@value')[0]
             
             # 准备登录数据
             # query_data = {
@@ -151,11 +534,13 @@ class ForumClient:
                 pass
             
             # 检查登录是否成功
-            if "reload" in response.text and self.base_url in response.text:
+            body = response.content
+            if b"reload" in body and self.base_url.encode('utf-8') in body:
                 self.is_logged_in = True
                 self.logger.info("论坛登录成功")
-                # 保存 session
+                # 保存 session，并在退出时再次保存
                 self._save_session()
+                self._register_atexit()
                 return True
             else:
                 raise ForumLoginException("登录失败，用户名密码或验证码错误")
@@ -170,28 +555,71 @@ class ForumClient:
             raise ForumLoginException("未登录，无法获取帖子")
         
         try:
-            # 获取帖子列表页面
-            response = self.session.get(f"{self.base_url}/forum.php?mod=guide&view=newthread")
-            tree = etree.HTML(response.content, parser=etree.HTMLParser())
+            threads = []
             
-            # 检查是否需要重新登录
-            if "login" in response.url or '登录' in tree.xpath('//section[@id="nav-additional"]//text()'):
+            # 带上次的缓存校验信息发起条件请求
+            headers = {}
+            if self._listing_cache is not None:
+                if self._listing_etag:
+                    headers['If-None-Match'] = self._listing_etag
+                if self._listing_lastmod:
+                    headers['If-Modified-Since'] = self._listing_lastmod
+            
+            # 流式解析帖子列表页面，只保留 #forumnew 之后表格中的 tbody
+            url = f"{self.base_url}/forum.php?mod=guide&view=newthread"
+            with self.session.get(url, headers=headers, stream=True) as response:
+                # 页面未变化，直接复用上次的解析结果
+                if response.status_code == 304 and self._listing_cache is not None:
+                    return list(self._listing_cache)
+                
+                login_expired = "login" in response.url
+                response.raw.decode_content = True
+                
+                context = etree.iterparse(
+                    response.raw,
+                    tag=('section', 'tbody'),
+                    html=True,
+                    encoding='utf-8',
+                    remove_comments=True,
+                    remove_pis=True
+                )
+                for _, element in context:
+                    if login_expired:
+                        break
+                    
+                    if element.tag == 'section':
+                        # 检查是否需要重新登录
+                        if element.get('id') == 'nav-additional' and '登录' in element.itertext():
+                            login_expired = True
+                        continue
+                    
+                    parent = element.getparent()
+                    if parent is None:
+                        continue
+                    
+                    anchor = parent.getprevious()
+                    if anchor is not None and anchor.tag == 'div' and anchor.get('id') == 'forumnew':
+                        post = self._parse_post_list_element(element)
+                        if post:
+                            threads.append(post)
+                    
+                    # 释放已处理的行，保持内存占用平稳
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del parent[0]
+            
+            if login_expired:
                 self.is_logged_in = False
                 # 清除失效的 session
                 self.clear_session()
                 raise ForumLoginException("登录已失效")
             
-            threads = []
-            
-            # 解析帖子列表
-            thread_elements = tree.xpath('//div[@id="forumnew"]/following-sibling::*[1]/tbody')
-            
-            for element in thread_elements:
-                post = self._parse_post_list_element(element)
-                if post:
-                    threads.append(post)
+            # 缓存本次结果和校验信息
+            self._listing_etag = response.headers.get('ETag')
+            self._listing_lastmod = response.headers.get('Last-Modified')
+            self._listing_cache = threads
             
-            return threads
+            return list(threads)
             
         except Exception as e:
             self.logger.error(f"获取帖子失败: {e}")
@@ -200,11 +628,14 @@ class ForumClient:
     def _parse_post_list_element(self, element: etree._Element) -> Optional[ForumPost]:
         """解析单个帖子列表元素（仅基本信息）"""
         try:
-            title = element.xpath('.//th[@class="common"]/a/text()')[0].strip()
-            url = element.xpath('.//th[@class="common"]/a/@href')[0].strip()
-            url = self.base_url + '/' + url
-            thread_id = int(url.split('t')[-1].split('-')[0])
-            author = element.xpath('.//td[@class="by"]/cite/a/text()')[0].strip()
+            title_link = _XP_TITLE(element)[0]
+            title = title_link.text.strip()
+            url = self._absurl(title_link.get('href').strip())
+            match = THREAD_ID_RE.search(url)
+            if not match:
+                raise ValueError(f"无法解析帖子ID: {url}")
+            thread_id = int(match.group(1))
+            author = _XP_AUTHOR(element)[0].strip()
             
             # 创建ForumPost对象，传入forum_client以支持懒加载
             return ForumPost(
@@ -229,30 +660,30 @@ class ForumClient:
                 self.logger.error(f"无法访问帖子页面: {thread_id}")
                 return None
             
-            post_tree = etree.HTML(response.content, parser=etree.HTMLParser())
+            post_tree = etree.fromstring(response.content, self._parser)
             
             # 检查是否需要重新登录
-            if "login" in response.url or '登录' in (post_tree.xpath('//section[@id="nav-additional"]//text()') or []):
+            if "login" in response.url or '登录' in _XP_NAV_TEXT(post_tree):
                 self.is_logged_in = False
                 self.clear_session()
                 raise ForumLoginException("登录已失效")
             
-            post_element = post_tree.xpath('//div[@id="postlist"]/div[contains(@id, "post_")]')[0]
-            post_id = post_element.xpath('./@id')[0].split('_')[-1]
+            post_element = _XP_POSTS(post_tree)[0]
+            post_id = post_element.get('id').split('_')[-1]
             
             # 提取标题
-            title_elements = post_tree.xpath('//a[@id="thread_subject"]')
+            title_elements = _XP_SUBJECT(post_tree)
             title = title_elements[0].text.strip() if title_elements else "未知标题"
             
             # 提取作者
-            author_elements = post_element.xpath('.//td[@class="pls"]//a[@class="xw1"]')
+            author_elements = _XP_POST_AUTHOR(post_element)
             author = author_elements[0].text.strip() if author_elements else "未知作者"
             
             # 解析发布时间
-            publish_time = self._parse_time(post_element.xpath(f'.//em[@id="authorposton{post_id}"]/span/@title')[0].strip())
+            publish_time = self._parse_time(_XP_POSTTIME(post_element, eid=f"authorposton{post_id}")[0].strip())
             
             # 解析内容
-            post_message = post_element.xpath(f'.//td[@id="postmessage_{post_id}"]')[0]
+            post_message = _XP_POSTMESSAGE(post_element, tid=f"postmessage_{post_id}")[0]
             content = self._parse_message_content(post_message)
             
             # 解析图片（可以在_parse_message_content中收集）
@@ -278,16 +709,15 @@ class ForumClient:
         """从内容中提取图片URL"""
         images = []
         try:
-            img_elements = message_element.xpath('.//img')
+            img_elements = _XP_IMGS(message_element)
             for img in img_elements:
-                src = img.get('src', '')
-                if src and not src.startswith('data:'):
-                    # 确保URL完整
-                    if src.startswith('/'):
-                        src = self.base_url + src
-                    elif not src.startswith('http'):
-                        src = self.base_url + '/' + src
-                    images.append(src)
+                # src 在论坛中是懒加载占位图，真实地址在 zoomfile/file 中
+                src = img.get('zoomfile') or img.get('file') or img.get('src', '')
+                # 跳过内嵌图片以及表情、占位图等论坛静态资源
+                if not src or src.startswith('data:') or src.startswith('static/') or '/static/image/' in src:
+                    continue
+                # 确保URL完整
+                images.append(self._absurl(src))
         except Exception as e:
             self.logger.error(f"提取图片失败: {e}")
         return images
@@ -298,7 +728,7 @@ class ForumClient:
         try:
             # 这里可以根据实际论坛的标签格式来解析
             # 例如寻找特定的CSS类或者标签格式
-            tag_elements = message_element.xpath('.//span[@class="tag"] | .//a[contains(@class, "tag")]')
+            tag_elements = _XP_TAGS(message_element)
             for tag_elem in tag_elements:
                 tag_text = tag_elem.text or ''
                 if tag_text.strip():
@@ -318,259 +748,54 @@ class ForumClient:
     def _parse_message_content(self, message_element: etree._Element) -> str:
         """解析帖子内容为字符串"""
         try:
-            content_parts: list[str] = []
-            skip_next_steam_span = False  # 添加标志来跳过Steam相关的span
-            
-            # 递归解析元素内容
-            def parse_element(element):
-                nonlocal skip_next_steam_span
-
-                # 处理文本内容
-                if element.text:
-                    text = element.text.strip()
-                    if text:
-                        if len(content_parts) > 0 and not any(content_parts[-1].startswith(prefix) for prefix in ['[', 'http', '*', '>', '\n']):
-                            content_parts[-1] += text
-                            if len(content_parts[-1]) > 50:
-                                content_parts[-1] = content_parts[-1][:50] + '...'
-                        else:
-                            content_parts.append(text)
-                
-                # 处理子元素
-                for child in element:
-                    tag = child.tag.lower()
-                    
-                    if tag == 'img':
-                        # 处理图片
-                        src = child.get('file', '')
-                        if src and not src.startswith('data:'):
-                            # 确保URL完整
-                            if src.startswith('/'):
-                                src = self.base_url + src
-                            elif not src.startswith('http'):
-                                src = self.base_url + '/' + src
-                            content_parts.append(f"[图片]({src})")
-                    
-                    elif tag == 'a':
-                        # 处理链接
-                        href = child.get('href', '')
-                        link_text = child.text or ''
-                        
-                        if href.endswith('.jpg') or href.endswith('.png') or href.endswith('.gif'):
-                            # 如果链接是图片，直接添加
-                            content_parts.append(f"[图片]({href})")
-                        if 'steam' in href.lower():
-                            # Steam相关链接特殊处理
-                            if link_text:
-                                content_parts.append(f"[{link_text}]({href})")
-                            else:
-                                content_parts.append(f"[Steam链接]({href})")
-                        elif href.startswith('#'):
-                            # 页面内锚点链接，只保留文本
-                            if link_text:
-                                content_parts.append(link_text)
-                        elif href and link_text:
-                            if 'javascript:' in href:
-                                # 跳过JavaScript链接
-                                continue
-                            # 确保URL完整
-                            if href.startswith('/'):
-                                href = self.base_url + href
-                            if (link_text[:5] == href[:5] and link_text[-5:] == href[-5:]):
-                                # 如果链接文本和URL相同，直接使用文本
-                                content_parts.append(link_text)
-                            else:
-                                content_parts.append(f"[{link_text}]({href})")
-                        elif link_text:
-                            content_parts.append(link_text)
-                    
-                    elif tag == 'iframe':
-                        # 处理iframe（如Steam小部件）
-                        src = child.get('src', '')
-                        class_attr = child.get('class', '')
-                        if 'steam' in src.lower(): # https://store.steampowered.com/widget/3289890/?utm_source=keylol
-                            # app_id_match = re.search(r'/(\d+)/', src)
-                            # if app_id_match:
-                            #     app_id = app_id_match.group(1)
-                            #     # 添加Steam小部件标记
-                            #     content_parts.append(f"[Steam小部件: {app_id}]")
-                            # else:
-                            #     content_parts.append(f"[Steam小部件: {src}]")
-                            if ('widget' in src): # https://store.steampowered.com/widget/3588970/?utm_source=keylol&cc=cn
-                                src = src.replace('widget', 'app')
-                            if 'app/' in src:
-                                app_id = src.split('app/')[-1].split('/?')[0]
-                                content_parts.append(f"[Steam app {app_id}](https://store.steampowered.com/app/{app_id})")
-                            else:
-                                content_parts.append(f"[Steam链接]({src})")
-                            # 设置标志，跳过下一个Steam相关的span
-                            skip_next_steam_span = True
-                        elif 'countdown' in src.lower():
-                            t = src.split('t=')[-1].split('&')[0]
-                            if t.isdigit():
-                                local_time = datetime.fromtimestamp(int(t))
-                                content_parts.append(f"[倒计时: {local_time.strftime('%Y-%m-%d %H:%M:%S')}]")
-                        else:
-                            if class_attr == 'html5video':
-                                if 'bilibili' in src:
-                                    bvid = src.split('?bvid=')[-1].split('&')[0]
-                                    content_parts.append(f"[{bvid}](https://www.bilibili.com/video/{bvid}/)")
-                                elif 'mp4=' in src:
-                                    src = src.split('mp4=')[-1]
-                                    content_parts.append(f"[视频]({src})")
-                            else:
-                                content_parts.append("[嵌入内容]")
-                    
-                    elif tag in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                        # 处理标题
-                        title_text = self._extract_text_content(child)
-                        if title_text:
-                            content_parts.append(f"\n**{title_text}**\n")
-                    
-                    elif tag == 'blockquote':
-                        # 处理引用
-                        quote_text = self._extract_text_content(child)
-                        if quote_text:
-                            # 为引用添加前缀
-                            quote_header = "**" if len(quote_text) >  50 else ""
-                            quoted_lines = [f"{quote_header}> {line}" for line in quote_text.split('\n') if line.strip()]
-                            content_parts.append('\n' + '\n'.join(quoted_lines) + '\n')
-                    
-                    elif tag == 'br':
-                        # 处理换行
-                        if len(content_parts) > 0 and not content_parts[-1].endswith('\n'):
-                            content_parts[-1] += '' if content_parts[-1].startswith('[') else '\n'
-                    
-                    elif tag == 'span':
-                        # 检查是否需要跳过Steam相关的span
-                        style_attr = child.get('style', '')
-                        
-                        # 检查是否是Steam小部件后的相关span（通过样式特征识别）
-                        if skip_next_steam_span and ('font-size: 10px' in style_attr or 'overflow: visible' in style_attr):
-                            # 检查span内容是否包含Steam相关链接
-                            span_text = self._extract_text_content(child)
-                            steam_links = child.xpath('.//a[contains(@href, "steam") or contains(@href, "steamdb")]')
-                            
-                            if steam_links or 'steam' in span_text.lower():
-                                # 跳过这个Steam相关的span
-                                skip_next_steam_span = False  # 重置标志
-                                continue
-                        
-                        # 处理其他span元素
-                        class_attr = child.get('class', '')
-                        
-                        # 跳过某些不需要的元素
-                        if any(skip_class in class_attr for skip_class in [
-                            'swi-block', 'steam-info-wrapper', 'tip', 'steam-info-loading', 'original_text_style1'
-                        ]):
-                            continue
-                        
-                        # 递归处理子元素
-                        parse_element(child)
-                    
-                    elif tag in ['div']:
-                        # 处理一般容器元素
-                        class_attr = child.get('class', '')
-                        
-                        # 跳过某些不需要的元素
-                        if any(skip_class in class_attr for skip_class in [
-                            'swi-block', 'steam-info-wrapper', 'tip', 'steam-info-loading', 'original_text_style1', 'rnd_ai_pr'
-                        ]):
-                            continue
-                        
-                        if class_attr == 'locked':
-                            content_parts.append("[隐藏内容]")
-                            continue
-                        
-                        # 递归处理子元素
-                        parse_element(child)
-                    
-                    elif tag == 'strong' or tag == 'b':
-                        # 处理粗体
-                        bold_text = self._extract_text_content(child)
-                        if bold_text:
-                            content_parts.append(f"**{bold_text}**")
-                    
-                    elif tag == 'em' or tag == 'i':
-                        # 处理斜体
-                        if '本帖最后由' not in child.text:
-                            italic_text = self._extract_text_content(child)
-                            if italic_text:
-                                content_parts.append(f"*{italic_text}*")
-                    
-                    elif tag in ['p', 'div'] and child.text:
-                        # 处理段落
-                        para_text = self._extract_text_content(child)
-                        if para_text:
-                            content_parts.append(f"\n{para_text}\n")
-                    
-                    elif any(skip_tag in tag for skip_tag in ['script', 'style']):
-                        # 跳过脚本和样式元素
-                        continue
-                    
-                    else:
-                        # 递归处理其他元素
-                        parse_element(child)
-                    
-                    # 处理尾部文本
-                    if child.tail:
-                        tail_text = child.tail.strip()
-                        if tail_text:
-                            if content_parts[-1].startswith('['):
-                                content_parts[-1] += '\n'
-                            content_parts.append(tail_text)
-            
-            # 开始解析
-            parse_element(message_element)
-            
-            if len(content_parts) > 1 and '[图片]' in content_parts[0] and '[Steam' in content_parts[1]:
-                content_parts = content_parts[1:]  # 如果第一个是图片，跳过
-            
-            # 合并内容并清理
-            content = ''
-            for part in content_parts:
-                if content:
-                    content += ' '
-                content += part
-                if len(content) > 2000:
-                    content += '...'
-                    break
-            
-            # 清理多余的空白字符
-            content = re.sub(r'\n\s*\n', '\n', content)  # 合并多个空行
-            content = re.sub(r' +', ' ', content)  # 合并多个空格
-            content = content.strip()
-            
-            return content
-            
+            return _MessageParser(self._absurl, self.logger).parse(message_element)
         except Exception as e:
             self.logger.error(f"解析帖子内容失败: {e}")
             return "内容解析失败"
 
-    def _extract_text_content(self, element: etree._Element) -> str:
-        """提取元素的纯文本内容"""
-        try:
-            # 使用xpath提取所有文本节点
-            text_nodes = element.xpath('.//text()')
-            text_content = ' '.join(node.strip() for node in text_nodes if node.strip())
-            return text_content
-        except Exception as e:
-            self.logger.error(f"提取文本内容失败: {e}")
-            return element.text or ''
-    
     def check_login_status(self) -> bool:
         """检查登录状态"""
+        # 短时间内已确认过登录有效，直接复用结果
+        if self.is_logged_in and time.monotonic() - self._login_checked_at < self.LOGIN_CHECK_TTL:
+            return True
+        
         try:
-            response = self.session.get(self.base_url)
-            is_valid = "member.php?mod=logging&amp;action=login" not in response.url and self.is_logged_in
-            if not is_valid:
+            # 只需要重定向后的地址，不解码响应体；完整读取响应以便连接放回连接池复用
+            response = self.session.get(self.base_url, allow_redirects=True)
+            redirected_to_login = "member.php?mod=logging&action=login" in response.url
+            is_valid = not redirected_to_login and self.is_logged_in
+            if is_valid:
+                self._login_checked_at = time.monotonic()
+            else:
                 self.is_logged_in = False
+                self._login_checked_at = 0.0
             return is_valid
         except Exception as e:
             self.logger.error(f"检查登录状态失败: {e}")
             return False
     
-    def __del__(self):
-        """析构函数，确保 session 被保存"""
-        if hasattr(self, 'is_logged_in') and self.is_logged_in:
-            self._save_session()
\ No newline at end of file
+    def _register_atexit(self):
+        """注册退出时保存 session，使用弱引用避免延长客户端生命周期"""
+        if self._atexit_registered:
+            return
+        close_ref = weakref.WeakMethod(self.close)
+        
+        def close_at_exit():
+            close = close_ref()
+            if close is not None:
+                close()
+        
+        atexit.register(close_at_exit)
+        self._atexit_registered = True
+    
+    def close(self):
+        """保存 session 并关闭连接"""
+        if self.is_logged_in:
+            self._save_session()
+        self.session.close()
+    
+    def __enter__(self) -> 'ForumClient':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
\ No newline at end of file
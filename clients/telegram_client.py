@@ -1,11 +1,13 @@
+import asyncio
 from pyrogram import Client
-from pyrogram.types import Message
+from pyrogram.types import InputMediaPhoto, Message
 from pyrogram.enums import ChatType
 import logging
 from typing import Optional, TYPE_CHECKING
 from models.post import ForumPost
 from io import BytesIO
-from config import Config
+from config import CONFIG
+from utils import THREAD_ID_PATTERN, AsyncLimiter
 import re
 
 if TYPE_CHECKING:
@@ -13,9 +15,30 @@ if TYPE_CHECKING:
 
 DEBUG_FLAG = False
 
+# 单条消息中同时抓取的帖子数量上限
+MAX_CONCURRENT_THREADS = 4
+
+# Telegram 单条文本消息的最大长度
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Telegram 相册中图片数量上限
+MEDIA_GROUP_LIMIT = 10
+
+# 退出时等待客户端断开连接的最长时间（秒）
+STOP_TIMEOUT = 10
+
+def _truncate_message(message: str) -> str:
+    """超出长度限制时截断消息"""
+    if len(message) <= TELEGRAM_MESSAGE_LIMIT:
+        return message
+    return message[:TELEGRAM_MESSAGE_LIMIT - 3] + "..."
+
 class TelegramClient:
     """Telegram客户端"""
 
+    # 匹配论坛帖子链接的正则表达式
+    _FORUM_LINK_RE = re.compile(re.escape(CONFIG.forum_base_url) + THREAD_ID_PATTERN)
+
     def __init__(self, api_id: int, api_hash: str, bot_token: str, work_dir: Optional[str] = None):
         self.api_id = api_id
         self.api_hash = api_hash
@@ -24,6 +47,11 @@ class TelegramClient:
         self.logger = logging.getLogger(__name__)
         self.work_dir = work_dir
         self.post_service: Optional['PostService'] = None
+        self._started = False
+        self._is_bot = bool(bot_token)
+        
+        # 论坛地址未配置时不匹配任何消息
+        self._forum_url_re = re.compile(re.escape(CONFIG.forum_base_url)) if CONFIG.forum_base_url else None
     
     def set_post_service(self, post_service: 'PostService'):
         """设置帖子服务引用"""
@@ -31,6 +59,9 @@ class TelegramClient:
     
     async def start(self):
         """启动Telegram客户端"""
+        if self._started:
+            return
+        
         try:
             if self.bot_token:
                 self.app = Client(
@@ -49,6 +80,13 @@ class TelegramClient:
             self.setup_handlers()
             
             await self.app.start()
+            self._started = True
+            
+            # 启动后绑定发送方法，Bot 每秒最多发送 30 条消息
+            self._send_message = self.app.send_message
+            self._send_photo = self.app.send_photo
+            self._send_media_group = self.app.send_media_group
+            self._channel_limiter = AsyncLimiter(30 if self._is_bot else 60, 1)
             self.logger.info("Telegram客户端启动成功")
 
         except Exception as e:
@@ -57,36 +95,54 @@ class TelegramClient:
     
     async def stop(self):
         """停止Telegram客户端"""
-        if self.app:
-            await self.app.stop()
+        if not self._started:
+            return
+        
+        self._started = False
+        await self.app.stop()
+    
+    async def __aenter__(self) -> 'TelegramClient':
+        await self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        # 即使退出过程被取消也要完成断开，保留会话以便下次快速重连
+        try:
+            await asyncio.shield(asyncio.wait_for(self.stop(), timeout=STOP_TIMEOUT))
+        except asyncio.TimeoutError:
+            self.logger.warning("Telegram客户端停止超时")
     
     async def send_post_to_channel(self, channel_id: int, post: ForumPost) -> bool:
         """发送帖子到频道"""
+        # 调试模式下不加载详情也不渲染消息
+        if DEBUG_FLAG:
+            self.logger.info(f"准备发送帖子到频道 {channel_id}: post_id={post.id}")
+            return True
+        
         try:
-            message = post.to_telegram_message()
-            
-            if DEBUG_FLAG:
-                self.logger.info(f"准备发送帖子到频道 {channel_id}: {message}")
-                return True
+            # 在线程池中加载详情，避免同步请求阻塞事件循环
+            if not post.is_details_loaded():
+                await asyncio.get_running_loop().run_in_executor(None, post.preload_details)
+            message = _truncate_message(post.to_telegram_message())
             
             # 发送文本消息
-            await self.app.send_message(
-                chat_id=channel_id,
-                text=message,
-                disable_web_page_preview=False
-            )
-            
-            # 如果有图片，发送图片
-            # if post.images:
-            #     for img_url in post.images[:3]:  # 最多发送3张图片
-            #         try:
-            #             await self.app.send_photo(
-            #                 chat_id=channel_id,
-            #                 photo=img_url,
-            #                 caption=message
-            #             )
-            #         except Exception as e:
-            #             self.logger.warning(f"发送图片失败: {e}")
+            async with self._channel_limiter:
+                await self._send_message(
+                    chat_id=channel_id,
+                    text=message,
+                    disable_web_page_preview=False
+                )
+            
+            # 多张图片合并为一个相册发送，文字已在上面的消息中
+            if self.count_channel_messages(post) > 1:
+                try:
+                    async with self._channel_limiter:
+                        await self._send_media_group(
+                            chat_id=channel_id,
+                            media=[InputMediaPhoto(img_url) for img_url in post.images[:MEDIA_GROUP_LIMIT]]
+                        )
+                except Exception as e:
+                    self.logger.warning(f"发送图片失败: {e}")
             
             self.logger.info(f"成功发送帖子到频道: {post.id} {post.title}")
             return True
@@ -95,6 +151,10 @@ class TelegramClient:
             self.logger.error(f"发送帖子到频道失败: {channel_id}, 错误: {e}")
             return False
     
+    def count_channel_messages(self, post: ForumPost) -> int:
+        """发送帖子到频道需要的消息条数，多张图片时额外发送一个相册"""
+        return 2 if len(post.images) >= 2 else 1
+    
     async def send_admin_notification(self, admin_id: int, message: str, 
                                     captcha_image: Optional[bytes] = None) -> bool:
         """发送管理员通知"""
@@ -103,21 +163,23 @@ class TelegramClient:
                 if DEBUG_FLAG:
                     self.logger.info(f"准备发送管理员通知: {message}")
                     return True
-                await self.app.send_message(
-                    chat_id=admin_id,
-                    text=message,
-                    disable_web_page_preview=False
-                )
+                async with self._channel_limiter:
+                    await self._send_message(
+                        chat_id=admin_id,
+                        text=message,
+                        disable_web_page_preview=False
+                    )
             # 如果有验证码图片，发送图片
             if captcha_image:
                 if DEBUG_FLAG:
                     self.logger.info("准备发送验证码图片给管理员")
                     return True
-                await self.app.send_photo(
-                    chat_id=admin_id,
-                    photo=BytesIO(captcha_image),
-                    caption="请输入验证码 (回复此消息)"
-                )
+                async with self._channel_limiter:
+                    await self._send_photo(
+                        chat_id=admin_id,
+                        photo=BytesIO(captcha_image),
+                        caption="请输入验证码 (回复此消息)"
+                    )
             
             return True
             
@@ -133,16 +195,23 @@ class TelegramClient:
     
     def setup_handlers(self):
         """设置消息处理器"""
+        forum_url_re = self._forum_url_re
+        
         @self.app.on_message()
         async def handle_message(client, message: Message):
-            if message.chat.type == ChatType.PRIVATE:
-                # 处理私聊消息
-                if message.text:
-                    self.logger.info(f"收到私聊消息: {message.chat.id}, 内容: {message.text if message.text else '无文本'}")
-                    
-                    # 检查是否包含论坛链接
-                    if Config.forum_base_url in message.text:
-                        await self._handle_forum_link_message(message)
+            # 只处理私聊消息
+            if message.chat.type != ChatType.PRIVATE:
+                return
+            
+            text = message.text
+            if not text:
+                return
+            
+            self.logger.info(f"收到私聊消息: {message.chat.id}, 内容: {text}")
+            
+            # 检查是否包含论坛链接
+            if forum_url_re and forum_url_re.search(text):
+                await self._handle_forum_link_message(message)
             
         self.logger.info("Telegram消息处理器已设置")
     
@@ -155,56 +224,73 @@ class TelegramClient:
             if not threads:
                 return
             
-            # 处理每个链接
-            for tid in threads:
-                if self.post_service:
-                    success = await self.post_service.process_single_thread(tid, message.chat.id)
-                    if not success:
-                        await self.app.send_message(
-                            chat_id=message.chat.id,
-                            text=f"抓取失败: {tid}"
-                        )
-                else:
-                    await self.app.send_message(
+            if not self.post_service:
+                async with self._channel_limiter:
+                    await self._send_message(
                         chat_id=message.chat.id,
                         text="服务未初始化，无法处理链接"
                     )
+                return
+            
+            # 并发处理所有链接，限制同时抓取的数量避免给论坛造成压力
+            post_service = self.post_service
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_THREADS)
+            
+            async def process(tid: int) -> bool:
+                async with semaphore:
+                    return await post_service.process_single_thread(tid, message.chat.id)
+            
+            results = await asyncio.gather(*(process(tid) for tid in threads), return_exceptions=True)
+            
+            # 汇总失败的链接，只发送一条消息
+            failed = []
+            for tid, result in zip(threads, results):
+                if isinstance(result, BaseException):
+                    self.logger.error(f"处理帖子 {tid} 失败: {result}")
+                if result is not True:
+                    failed.append(str(tid))
+            if failed:
+                async with self._channel_limiter:
+                    await self._send_message(
+                        chat_id=message.chat.id,
+                        text=f"抓取失败: {', '.join(failed)}"
+                    )
                     
         except Exception as e:
             self.logger.error(f"处理论坛链接消息失败: {e}")
-            await self.app.send_message(
-                chat_id=message.chat.id,
-                text=f"处理链接时出错: {str(e)}"
-            )
+            async with self._channel_limiter:
+                await self._send_message(
+                    chat_id=message.chat.id,
+                    text=f"处理链接时出错: {str(e)}"
+                )
     
     def _extract_forum_links(self, text: str) -> list[int]:
         """从文本中提取论坛链接"""
-        # 匹配论坛帖子链接的正则表达式
-        patterns = [
-            rf"{re.escape(Config.forum_base_url)}/thread-(\d+)",
-            rf"{re.escape(Config.forum_base_url)}/t(\d+)",
-        ]
-        threads = []
-        for pattern in patterns:
-            matches = re.findall(pattern, text)
-            threads.extend([int(match) for match in matches if match.isdigit()])
-        return list(set(threads))
+        # 按出现顺序去重
+        threads: dict[int, None] = {}
+        for match in self._FORUM_LINK_RE.finditer(text):
+            threads.setdefault(int(match.group(1)), None)
+        return list(threads)
     
     async def send_post_to_user(self, user_id: int, post: ForumPost) -> bool:
         """发送帖子给用户"""
         try:
-            message = post.to_telegram_message()
+            # 在线程池中加载详情，避免同步请求阻塞事件循环
+            if not post.is_details_loaded():
+                await asyncio.get_running_loop().run_in_executor(None, post.preload_details)
+            message = _truncate_message(post.to_telegram_message())
             
             if DEBUG_FLAG:
                 self.logger.info(f"准备发送帖子给用户 {user_id}: {message}")
                 return True
             
             # 发送文本消息
-            await self.app.send_message(
-                chat_id=user_id,
-                text=message,
-                disable_web_page_preview=True
-            )
+            async with self._channel_limiter:
+                await self._send_message(
+                    chat_id=user_id,
+                    text=message,
+                    disable_web_page_preview=True
+                )
             
             self.logger.info(f"成功发送帖子给用户 {user_id}: {post.id} {post.title}")
             return True
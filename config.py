@@ -4,28 +4,45 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     # Telegram配置
-    telegram_api_id: int = int(os.getenv('TELEGRAM_API_ID', '0'))
-    telegram_api_hash: str = os.getenv('TELEGRAM_API_HASH', '')
-    telegram_bot_token: str = os.getenv('TELEGRAM_BOT_TOKEN', '')
-    telegram_channel_id: int = int(os.getenv('TELEGRAM_CHANNEL_ID', '0'))
-    telegram_admin_id: int = int(os.getenv('TELEGRAM_ADMIN_ID', '0'))
+    telegram_api_id: int = 0
+    telegram_api_hash: str = ''
+    telegram_bot_token: str = ''
+    telegram_channel_id: int = 0
+    telegram_admin_id: int = 0
     
     # 论坛配置
-    forum_base_url: str = os.getenv('FORUM_BASE_URL', '')
-    forum_username: str = os.getenv('FORUM_USERNAME', '')
-    forum_password: str = os.getenv('FORUM_PASSWORD', '')
+    forum_base_url: str = ''
+    forum_username: str = ''
+    forum_password: str = ''
     
     # 其他配置
-    check_interval: int = int(os.getenv('CHECK_INTERVAL', '300'))  # 5分钟
-    max_posts_per_check: int = int(os.getenv('MAX_POSTS_PER_CHECK', '10'))
+    check_interval: int = 300  # 5分钟
+    max_posts_per_check: int = 10
     
-    def validate(self) -> bool:
+    @classmethod
+    def from_env(cls) -> 'Config':
+        """从环境变量读取配置"""
+        return cls(
+            telegram_api_id=int(os.getenv('TELEGRAM_API_ID', '0')),
+            telegram_api_hash=os.getenv('TELEGRAM_API_HASH', ''),
+            telegram_bot_token=os.getenv('TELEGRAM_BOT_TOKEN', ''),
+            telegram_channel_id=int(os.getenv('TELEGRAM_CHANNEL_ID', '0')),
+            telegram_admin_id=int(os.getenv('TELEGRAM_ADMIN_ID', '0')),
+            forum_base_url=os.getenv('FORUM_BASE_URL', ''),
+            forum_username=os.getenv('FORUM_USERNAME', ''),
+            forum_password=os.getenv('FORUM_PASSWORD', ''),
+            check_interval=int(os.getenv('CHECK_INTERVAL', '300')),
+            max_posts_per_check=int(os.getenv('MAX_POSTS_PER_CHECK', '10')),
+        )
+    
+    @property
+    def is_valid(self) -> bool:
         """验证配置是否完整"""
-        required_fields = [
-            self.telegram_api_id, self.telegram_api_hash,
-            self.telegram_channel_id, self.forum_base_url
-        ]
-        return all(field for field in required_fields)
+        return bool(self.telegram_api_id and self.telegram_api_hash
+                    and self.telegram_channel_id and self.forum_base_url)
+
+# 进程内共享的配置，只在导入时读取一次环境变量
+CONFIG = Config.from_env()
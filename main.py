@@ -1,69 +1,102 @@
 import asyncio
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 import signal
 import sys
-from config import Config
+from typing import Optional
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from config import CONFIG
 from clients.forum_client import ForumClient
 from clients.telegram_client import TelegramClient
 from services.scheduler import TaskScheduler
 from services.post_service import PostService
 
+# 退出时发送通知的最长等待时间（秒）
+SHUTDOWN_TIMEOUT = 10
+
 class KeylolTelegramApp:
     """主应用程序"""
     
     def __init__(self):
-        self.config = Config()
+        self.config = CONFIG
         self.forum_client = None
-        self.telegram_client = None
-        self.scheduler : TaskScheduler
-        self.post_service : PostService
+        self.telegram_client: Optional[TelegramClient] = None
+        self.scheduler : Optional[TaskScheduler] = None
+        self.post_service : Optional[PostService] = None
         self.work_dir = 'data'
         self.logger = self._setup_logging()
         self._should_exit = asyncio.Event()
-        
-        # 设置信号处理
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        self._stop_task: Optional[asyncio.Task] = None
     
     def _setup_logging(self) -> logging.Logger:
-        """设置日志"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(self.work_dir + '/keylol-tg.log', encoding='utf-8'),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
+        """设置日志，由后台线程从队列中取出记录写入文件和控制台"""
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler = logging.FileHandler(self.work_dir + '/keylol-tg.log', encoding='utf-8')
+        stream_handler = logging.StreamHandler(sys.stdout)
+        file_handler.setFormatter(formatter)
+        stream_handler.setFormatter(formatter)
+        
+        log_queue: SimpleQueue = SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(message)s'))
+        logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+        
+        self._log_listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        self._log_listener.start()
         return logging.getLogger(__name__)
     
-    def _signal_handler(self, signum, frame):
-        """信号处理器"""
+    def _signal_handler(self, signum: int):
+        """信号处理器，由事件循环在主线程中调用"""
         self.logger.info(f"收到信号 {signum}，准备退出...")
-        asyncio.create_task(self.stop())
+        if self._stop_task is None:
+            self._stop_task = asyncio.create_task(self.stop())
     
     async def start(self):
         """启动应用"""
         try:
             # 验证配置
-            if not self.config.validate():
+            if not self.config.is_valid:
                 self.logger.error("配置验证失败，请检查环境变量")
                 return False
             
             self.logger.info("启动 Keylol Telegram 应用...")
             
-            # 初始化各个组件
-            await self._initialize_components()
-            
-            # 启动调度器
-            self.scheduler.start()
-            
-            self.logger.info("应用启动成功，开始监控...")
+            # 设置信号处理
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, self._signal_handler, sig)
+                except NotImplementedError:
+                    # Windows 不支持 add_signal_handler，改用 signal.signal 转交给事件循环处理
+                    signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self._signal_handler, signum))
             
-            await self.post_service.check_and_send_new_posts()
-            
-            # 保持运行
-            await self._keep_running()
+            # 初始化Telegram客户端，退出运行时自动停止
+            async with TelegramClient(
+                self.config.telegram_api_id,
+                self.config.telegram_api_hash,
+                self.config.telegram_bot_token,
+                work_dir=self.work_dir
+            ) as telegram_client:
+                self.telegram_client = telegram_client
+                
+                # 初始化各个组件
+                await self._initialize_components()
+                
+                # 启动调度器
+                self.scheduler.start()
+                
+                self.logger.info("应用启动成功，开始监控...")
+                
+                await self.post_service.check_and_send_new_posts()
+                
+                # 保持运行
+                await self._keep_running()
             
         except Exception as e:
             self.logger.error(f"应用启动失败: {e}")
@@ -79,15 +112,6 @@ class KeylolTelegramApp:
             work_dir=self.work_dir
         )
         
-        # 初始化Telegram客户端
-        self.telegram_client = TelegramClient(
-            self.config.telegram_api_id,
-            self.config.telegram_api_hash,
-            self.config.telegram_bot_token,
-            work_dir=self.work_dir
-        )
-        await self.telegram_client.start()
-        
         # 初始化帖子服务
         self.post_service = PostService(
             self.forum_client,
@@ -138,12 +162,24 @@ class KeylolTelegramApp:
         if self.scheduler:
             self.scheduler.stop()
         
+        if self.post_service:
+            self.post_service.close()
+        
+        if self.forum_client:
+            self.forum_client.close()
+        
         if self.telegram_client:
-            await self.telegram_client.send_admin_notification(
-                self.config.telegram_admin_id,
-                "Keylol Telegram 应用已停止"
-            )
-            await self.telegram_client.stop()
+            # 防止通知发送被取消或长时间阻塞退出
+            try:
+                await asyncio.shield(asyncio.wait_for(
+                    self.telegram_client.send_admin_notification(
+                        self.config.telegram_admin_id,
+                        "Keylol Telegram 应用已停止"
+                    ),
+                    timeout=SHUTDOWN_TIMEOUT
+                ))
+            except asyncio.TimeoutError:
+                self.logger.warning("发送停止通知超时")
         
         self._should_exit.set()
         self.logger.info("应用已停止")
@@ -151,7 +187,12 @@ class KeylolTelegramApp:
 async def main():
     """主函数"""
     app = KeylolTelegramApp()
-    await app.start()
+    try:
+        await app.start()
+    finally:
+        # Telegram客户端在 start() 返回前才断开，最后再停止日志线程，确保队列中的日志全部写出
+        app._log_listener.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # 安装了 uvloop 时使用更快的事件循环
+    asyncio.run(main(), loop_factory=uvloop.new_event_loop if uvloop else None)
@@ -1,5 +1,6 @@
+import threading
 from datetime import datetime
-from typing import List, Optional, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from clients.forum_client import ForumClient
@@ -24,28 +25,46 @@ class ForumPost:
         # 用于懒加载的客户端
         self._forum_client = forum_client
         self._is_loaded = False
+        # 详情可能在线程池中加载，用锁避免重复请求
+        self._load_lock = threading.Lock()
+        
+        # 渲染后的消息缓存
+        self._rendered: Optional[str] = None
     
     def _load_details(self):
         """加载详细信息"""
         if self._is_loaded or not self._forum_client:
             return
         
-        try:
-            # 使用forum_client加载详细信息
-            post_details = self._forum_client.load_post_details(self.id)
+        with self._load_lock:
+            if self._is_loaded:
+                return
+            
+            try:
+                # 使用forum_client加载详细信息
+                post_details = self._forum_client.load_post_details(self.id)
+            except Exception as _:
+                post_details = None
+            
             if post_details:
-                self._content = post_details.get('content', '')
-                self._publish_time = post_details.get('publish_time', datetime.now())
-                self._images = post_details.get('images', [])
-                self._tags = post_details.get('tags', [])
+                self.apply_details(post_details)
+            else:
+                # 加载失败时设置默认值并标记为已加载，避免各属性再次触发同步请求
+                self._content = "内容加载失败"
+                self._publish_time = datetime.now()
+                self._images = []
+                self._tags = []
+                self._rendered = None
                 self._is_loaded = True
-        except Exception as _:
-            # 设置默认值
-            self._content = "内容加载失败"
-            self._publish_time = datetime.now()
-            self._images = []
-            self._tags = []
-            self._is_loaded = True
+    
+    def apply_details(self, post_details: Dict[str, Any]):
+        """填充已获取的详细信息"""
+        self._content = post_details.get('content', '')
+        self._publish_time = post_details.get('publish_time', datetime.now())
+        self._images = post_details.get('images', [])
+        self._tags = post_details.get('tags', [])
+        self._rendered = None
+        self._is_loaded = True
     
     @property
     def content(self) -> str:
@@ -77,16 +96,22 @@ class ForumPost:
     
     def to_telegram_message(self) -> str:
         """转换为Telegram消息格式"""
-        message = f"**{self.title}**\n"
-        message += f"{self.author} \\ {self.publish_time.strftime('%Y-%m-%d %H:%M')}\n"
+        if self._rendered is not None:
+            return self._rendered
+        
+        lines = [
+            f"**{self.title}**",
+            f"{self.author} \\ {self.publish_time.strftime('%Y-%m-%d %H:%M')}"
+        ]
         
         if self.tags:
-            message += f"标签: {', '.join(self.tags)}\n"
+            lines.append(f"标签: {', '.join(self.tags)}")
         
-        message += f"{self.content}\n"
-        message += f"\n[查看原帖]({self.url})"
+        lines.append(self.content)
+        lines.append(f"\n[查看原帖]({self.url})")
         
-        return message
+        self._rendered = '\n'.join(lines)
+        return self._rendered
     
     def is_details_loaded(self) -> bool:
         """检查详细信息是否已加载"""
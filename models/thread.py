@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import List, Optional
 from models.post import ForumPost
@@ -11,9 +11,9 @@ class ForumThread:
     author: str
     publish_time: datetime
     url: str
-    images: List[str] = []  
-    tags: List[str] = []
-    posts: List[ForumPost] = []
+    images: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    posts: List[ForumPost] = field(default_factory=list)
 
     def to_telegram_message(self) -> str:
         """转换为Telegram消息格式"""
@@ -1,17 +1,23 @@
 import asyncio
 import logging
-from typing import Optional, Set, TYPE_CHECKING
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Optional, Set, TYPE_CHECKING
 from datetime import datetime
-import json
 import os
-import re
 
 from clients.forum_client import ForumClient, CaptchaRequiredException, ForumLoginException
 from models.post import ForumPost
+from utils import AsyncLimiter, json_dumps, json_loads
 
 if TYPE_CHECKING:
     from clients.telegram_client import TelegramClient
 
+# 最多保留的已处理帖子ID数量
+MAX_PROCESSED_POSTS = 1000
+# 增量日志累计多少条记录后合并到主文件
+COMPACT_THRESHOLD = 100
+
 class PostService:
     """帖子处理服务"""
     
@@ -24,40 +30,109 @@ class PostService:
         self.max_posts = max_posts
         self.logger = logging.getLogger(__name__)
         
-        # 已处理的帖子ID集合
+        # 论坛请求使用的专用线程池，不占用默认 executor
+        self._io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='post-io')
+        
+        # 频道发送的并发数和速率限制（每分钟最多 20 条）
+        self._send_semaphore = asyncio.Semaphore(5)
+        self._send_limiter = AsyncLimiter(max_rate=20, time_period=60)
+        
+        # 已处理的帖子ID：deque 按处理顺序保留最近的记录，set 用于快速查找
+        self._processed_order: Deque[int] = deque(maxlen=MAX_PROCESSED_POSTS)
         self.processed_posts: Set[int] = set()
         self.last_post: int = 0
         self.cache_file = os.path.join(work_dir, "processed_posts.json") if work_dir else "processed_posts.json"
+        # 新处理的帖子ID先追加到增量日志，定期合并到主文件
+        self._delta_path = self.cache_file + ".log"
+        self._delta_count = 0
         self._load_processed_posts()
     
     def _load_processed_posts(self):
         """加载已处理的帖子ID"""
         try:
             if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.processed_posts = set(data.get('posts', []))
-                    self.last_post = data.get('last_post', 0)
-                    self.logger.info(f"加载了 {len(self.processed_posts)} 个已处理的帖子ID")
+                with open(self.cache_file, 'rb') as f:
+                    data = json_loads(f.read())
+                    # 帖子ID随时间递增，按升序恢复处理顺序
+                    for post_id in sorted(data.get('posts', [])):
+                        self._mark_processed(post_id)
+                    self.last_post = max(self.last_post, data.get('last_post', 0))
+            
+            # 重放上次合并之后的增量日志
+            if os.path.exists(self._delta_path):
+                with open(self._delta_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            self._mark_processed(json_loads(line)['id'])
+                        except Exception:
+                            # 跳过中途退出时写了一半的记录
+                            continue
+                        self._delta_count += 1
+            
+            self.logger.info(f"加载了 {len(self.processed_posts)} 个已处理的帖子ID")
         except Exception as e:
             self.logger.error(f"加载已处理帖子失败: {e}")
     
+    def _mark_processed(self, post_id: int):
+        """记录已处理的帖子ID，超出上限时淘汰最早的记录"""
+        if post_id in self.processed_posts:
+            return
+        if len(self._processed_order) == self._processed_order.maxlen:
+            self.processed_posts.discard(self._processed_order[0])
+        self._processed_order.append(post_id)
+        self.processed_posts.add(post_id)
+        if post_id > self.last_post:
+            self.last_post = post_id
+    
+    def _record_processed(self, post_id: int):
+        """记录新处理的帖子ID，并追加到增量日志"""
+        if post_id in self.processed_posts:
+            return
+        self._mark_processed(post_id)
+        try:
+            with open(self._delta_path, 'ab') as f:
+                f.write(json_dumps({'id': post_id, 'ts': datetime.now().isoformat()}) + b'\n')
+            self._delta_count += 1
+        except Exception as e:
+            self.logger.error(f"写入已处理帖子日志失败: {e}")
+    
     def _save_processed_posts(self):
         """保存已处理的帖子ID"""
         try:
-            # 只保留最大的200个帖子ID，避免文件过大
-            posts_to_save = sorted(self.processed_posts, reverse=True)[:200]
-            last_post = max(posts_to_save, default=0)
+            # deque 已限制了记录数量，直接按处理顺序保存
             data = {
-                'posts': posts_to_save,
+                'posts': list(self._processed_order),
                 'last_update': datetime.now().isoformat(),
-                'last_post': last_post
+                'last_post': self.last_post
             }
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 先写入临时文件再替换，避免中途退出留下不完整的文件
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(json_dumps(data))
+            os.replace(tmp_file, self.cache_file)
+            
+            # 主文件已包含全部记录，清空增量日志
+            if os.path.exists(self._delta_path):
+                os.remove(self._delta_path)
+            self._delta_count = 0
         except Exception as e:
             self.logger.error(f"保存已处理帖子失败: {e}")
     
+    def _maybe_flush(self):
+        """增量日志累计足够多的记录后合并到主文件"""
+        if self._delta_count >= COMPACT_THRESHOLD:
+            self._save_processed_posts()
+    
+    def flush(self):
+        """立即将增量日志合并到主文件"""
+        if self._delta_count:
+            self._save_processed_posts()
+    
+    def close(self):
+        """保存状态并关闭线程池"""
+        self.flush()
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+    
     async def check_and_send_new_posts(self):
         """检查并发送新帖子"""
         try:
@@ -68,7 +143,8 @@ class PostService:
             
             # 获取最新帖子
             posts = self.forum_client.get_latest_posts(self.max_posts)
-            new_posts = [post for post in posts if post.id not in self.processed_posts]
+            new_ids = {post.id for post in posts} - self.processed_posts
+            new_posts = [post for post in posts if post.id in new_ids]
             
             if not new_posts:
                 self.logger.info("没有新帖子")
@@ -76,18 +152,23 @@ class PostService:
             
             self.logger.info(f"发现 {len(new_posts)} 个新帖子")
             
-            # 发送新帖子到频道
-            for post in new_posts:
-                success = await self.telegram_client.send_post_to_channel(
-                    self.channel_id, post
-                )
-                
-                if success:
-                    self.processed_posts.add(post.id)
-                    await asyncio.sleep(2)  # 避免发送过快
+            # 在专用线程池中并发预加载帖子详情，避免发送时逐个懒加载
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self._io_pool, post.preload_details) for post in new_posts
+            ))
+            
+            # 并发发送新帖子到频道，由限流器控制发送速率
+            results = await asyncio.gather(
+                *(self._send_one(post) for post in new_posts),
+                return_exceptions=True
+            )
+            for post, result in zip(new_posts, results):
+                if isinstance(result, BaseException):
+                    self.logger.error(f"发送帖子失败: {post.id}, 错误: {result}")
             
             # 保存已处理的帖子ID
-            self._save_processed_posts()
+            self._maybe_flush()
             
         except ForumLoginException as e:
             self.logger.warning(f"论坛登录异常: {e}")
@@ -104,6 +185,17 @@ class PostService:
                 f"检查新帖子时出错: {str(e)}"
             )
     
+    async def _send_one(self, post: ForumPost) -> bool:
+        """发送单个帖子到频道"""
+        async with self._send_semaphore, self._send_limiter:
+            # 带相册的帖子会发送两条消息，额外占用一次发送额度
+            for _ in range(self.telegram_client.count_channel_messages(post) - 1):
+                await self._send_limiter.acquire()
+            success = await self.telegram_client.send_post_to_channel(self.channel_id, post)
+        if success:
+            self._record_processed(post.id)
+        return success
+    
     async def _handle_login_required(self):
         """处理需要重新登录的情况"""
         try:
@@ -156,7 +248,9 @@ class PostService:
                     return False
             
             # 获取帖子详细信息
-            post_details = self.forum_client.load_post_details(thread_id)
+            post_details = await asyncio.get_running_loop().run_in_executor(
+                self._io_pool, self.forum_client.load_post_details, thread_id
+            )
             if not post_details:
                 await self.telegram_client.send_admin_notification(
                     user_id,
@@ -226,11 +320,7 @@ class PostService:
             )
             
             # 手动设置已加载的详情
-            post._content = post_details.get('content', '')
-            post._publish_time = post_details.get('publish_time', datetime.now())
-            post._images = post_details.get('images', [])
-            post._tags = post_details.get('tags', [])
-            post._is_loaded = True
+            post.apply_details(post_details)
             
             return post
             
@@ -1,70 +1,375 @@
 import asyncio
-import schedule
-import time
-import threading
+import functools
+import heapq
+import itertools
 import logging
-from typing import Callable
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+class _Bucket:
+    """间隔相同的任务共用一个定时器"""
+    
+    __slots__ = ('seq', 'index', 'ids', 'coro_flags', 'calls')
+    
+    def __init__(self, seq: int):
+        self.seq = seq
+        # 任务信息按列存放在平行数组中，index 记录 job_id 所在的位置
+        self.index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.coro_flags = bytearray()
+        self.calls: List[Callable[[], Any]] = []
+    
+    def add(self, job_id: str, is_coro: bool, call: Callable[[], Any]):
+        """添加任务"""
+        self.index[job_id] = len(self.ids)
+        self.ids.append(job_id)
+        self.coro_flags.append(is_coro)
+        self.calls.append(call)
+    
+    def remove(self, job_id: str):
+        """删除任务，用最后一项填补空位"""
+        i = self.index.pop(job_id)
+        last = len(self.ids) - 1
+        if i != last:
+            moved = self.ids[last]
+            self.ids[i] = moved
+            self.coro_flags[i] = self.coro_flags[last]
+            self.calls[i] = self.calls[last]
+            self.index[moved] = i
+        self.ids.pop()
+        self.coro_flags.pop()
+        self.calls.pop()
 
 class TaskScheduler:
-    """任务调度器"""
+    """任务调度器，直接运行在事件循环上"""
     
-    def __init__(self, loop=None):
+    def __init__(self, loop=None, max_concurrency: int = 8, queue_size: int = 1024):
         self.is_running = False
-        self.thread = None
         self.logger = logging.getLogger(__name__)
-        self.jobs = {}
+        # job_id -> 间隔
+        self.jobs: Dict[str, int] = {}
+        # 用于生成不重复的任务ID，移除任务后编号也不会复用
+        self._job_seq = itertools.count()
+        # 间隔 -> 该间隔下的所有任务
+        self._buckets: Dict[int, _Bucket] = {}
+        # 指定时间执行的任务：job_id -> (下次执行时间, 重复间隔, 是否为协程函数, 无参调用函数)
+        # 调度器运行时为每个任务设置事件循环定时器，停止时只取消定时器，保留任务
+        self._timed: Dict[str, Tuple[datetime, Optional[int], bool, Callable[[], Any]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # 用于生成不重复的定时任务ID，已执行的任务移除后编号也不会复用
+        self._timer_seq = itertools.count()
         self.loop = loop
+        self._task: Optional[asyncio.Task] = None
+        # 每个间隔一项，按下次触发时间排序的最小堆：(触发时间, 序号, 间隔)
+        # 清空的间隔不从堆中删除，弹出时发现序号不匹配再丢弃
+        self._heap: List[Tuple[float, int, int]] = []
+        # 堆中已失效的项数，超过四分之一时整体清理
+        self._stale = 0
+        self._seq = itertools.count()
+        # 用于在添加/移除任务或停止时提前唤醒调度协程
+        self._wake = asyncio.Event()
+        # 到期的任务放入有界队列，由固定数量的工作协程执行
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # 空闲的工作协程数量，没有空闲时才按需创建新的工作协程
+        self._idle_workers = 0
+        # 保护任务分组和堆，允许在其他线程中添加/移除任务
+        self._lock = threading.Lock()
+        # 保证 start/stop 的状态检查和修改是原子的
+        self._lifecycle_lock = threading.Lock()
     
     def add_job(self, func: Callable, interval: int, job_id: str = "", **kwargs):
         """添加定时任务"""
-        if not job_id:
-            job_id = f"job_{len(self.jobs)}"
-
-        # 包装异步函数为同步可调用
-        if asyncio.iscoroutinefunction(func):
-            def sync_wrapper(*args, **kw):
-                if self.loop:
-                    asyncio.run_coroutine_threadsafe(func(*args, **kw), self.loop)
-                else:
-                    self.logger.error("未设置事件循环，无法调度异步任务")
-            job = schedule.every(interval).seconds.do(sync_wrapper, **kwargs)
+        return self.add_jobs([(func, interval, job_id, kwargs)])[0]
+    
+    def add_jobs(self, specs: Iterable[Tuple[Callable, int, str, dict]]) -> List[str]:
+        """批量添加定时任务，specs 中每项为 (函数, 间隔, job_id, 参数)"""
+        # 先检查并绑定所有任务，出错时不会只添加一部分
+        prepared = [
+            (interval, job_id, *self._prepare_job(func, kwargs))
+            for func, interval, job_id, kwargs in specs
+        ]
+        
+        job_ids = []
+        new_bucket = False
+        with self._lock:
+            for interval, job_id, is_coro, call in prepared:
+                if not job_id:
+                    job_id = f"job_{next(self._job_seq)}"
+                self._discard_job(job_id)
+                
+                # 加入相同间隔的分组，没有时新建并加入堆
+                bucket = self._buckets.get(interval)
+                if bucket is None:
+                    bucket = self._buckets[interval] = _Bucket(next(self._seq))
+                    heapq.heappush(self._heap, (time.monotonic() + interval, bucket.seq, interval))
+                    new_bucket = True
+                bucket.add(job_id, is_coro, call)
+                self.jobs[job_id] = interval
+                job_ids.append(job_id)
+        if new_bucket:
+            self._notify()
+        
+        if len(prepared) == 1:
+            self.logger.info(f"添加定时任务: {job_ids[0]}, 间隔: {prepared[0][0]}秒")
         else:
-            job = schedule.every(interval).seconds.do(func, **kwargs)
-
-        self.jobs[job_id] = job
-        self.logger.info(f"添加定时任务: {job_id}, 间隔: {interval}秒")
+            self.logger.info(f"添加了 {len(job_ids)} 个定时任务: {', '.join(job_ids)}")
+        return job_ids
+    
+    def _prepare_job(self, func: Callable, kwargs: dict) -> Tuple[bool, Callable[[], Any]]:
+        """判断任务类型并绑定参数"""
+        is_coro = asyncio.iscoroutinefunction(func)
+        if is_coro and self.loop is None:
+            # 没有事件循环时立即报错，而不是每次触发时才失败
+            try:
+                self.loop = asyncio.get_running_loop()
+            except RuntimeError:
+                raise RuntimeError("未设置事件循环，无法调度异步任务") from None
+        
+        # 添加时就绑定好参数，没有参数时直接保存原函数，触发时不再展开参数
+        call = functools.partial(func, **kwargs) if kwargs else func
+        return is_coro, call
+    
+    def add_job_at(self, func: Callable, when: datetime, job_id: str = "",
+                   interval: Optional[int] = None, **kwargs):
+        """添加在指定时间执行的任务，指定 interval 时之后按该间隔重复执行
+        
+        直接使用事件循环的定时器，需要在事件循环所在线程中调用。
+        调度器未启动时任务会在 start() 时生效。
+        """
+        if not job_id:
+            job_id = f"at_{next(self._timer_seq)}"
+        
+        is_coro, call = self._prepare_job(func, kwargs)
+        self._discard_timer(job_id)
+        self._timed[job_id] = (when, interval, is_coro, call)
+        if self.is_running:
+            self._arm_timer(job_id)
+        self.logger.info(f"添加定时任务: {job_id}, 执行时间: {when}")
         return job_id
     
+    def _arm_timer(self, job_id: str):
+        """按任务的下次执行时间设置事件循环定时器"""
+        when = self._timed[job_id][0]
+        delay = max(0.0, (when - datetime.now()).total_seconds())
+        self._timers[job_id] = self.loop.call_later(delay, self._fire_timer, job_id)
+    
+    def _fire_timer(self, job_id: str):
+        """指定时间的任务到期，重复任务设置下一次定时器"""
+        self._timers.pop(job_id, None)
+        spec = self._timed.get(job_id)
+        if spec is None:
+            return
+        _, interval, is_coro, call = spec
+        if interval:
+            self._timed[job_id] = (datetime.now() + timedelta(seconds=interval), interval, is_coro, call)
+            self._arm_timer(job_id)
+        else:
+            del self._timed[job_id]
+        self._enqueue(job_id, is_coro, call)
+    
     def remove_job(self, job_id: str):
-        """移除定时任务"""
-        if job_id in self.jobs:
-            schedule.cancel_job(self.jobs[job_id])
-            del self.jobs[job_id]
+        """移除定时任务，移除 add_job_at 添加的任务时需要在事件循环所在线程中调用"""
+        with self._lock:
+            removed = self._discard_job(job_id)
+        if removed or self._discard_timer(job_id):
             self.logger.info(f"移除定时任务: {job_id}")
     
-    def start(self):
-        """启动调度器"""
-        if self.is_running:
+    def _notify(self):
+        """唤醒调度协程，可以在其他线程中调用"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self.loop is None or running is self.loop:
+            self._wake.set()
+        else:
+            self.loop.call_soon_threadsafe(self._wake.set)
+    
+    def _discard_timer(self, job_id: str) -> bool:
+        """删除指定时间执行的任务并取消其定时器，需要在事件循环所在线程中调用"""
+        handle = self._timers.pop(job_id, None)
+        if handle is not None:
+            handle.cancel()
+        return self._timed.pop(job_id, None) is not None
+    
+    def _discard_job(self, job_id: str) -> bool:
+        """从所属分组中删除任务，分组为空时一并删除，需持有 _lock"""
+        interval = self.jobs.pop(job_id, None)
+        if interval is None:
+            return False
+        bucket = self._buckets[interval]
+        bucket.remove(job_id)
+        if not bucket.ids:
+            del self._buckets[interval]
+            self._stale += 1
+            if self._stale > len(self._heap) // 4:
+                self._sweep_heap()
+        return True
+    
+    def _sweep_heap(self):
+        """清除堆中已失效的分组项"""
+        buckets = self._buckets
+        self._heap[:] = [
+            entry for entry in self._heap
+            if (bucket := buckets.get(entry[2])) is not None and bucket.seq == entry[1]
+        ]
+        heapq.heapify(self._heap)
+        self._stale = 0
+    
+    def _enqueue(self, job_id: str, is_coro: bool, call: Callable[[], Any]):
+        """将单个任务放入执行队列"""
+        if self._queue is None:
+            self.logger.warning(f"调度器未运行，跳过本次执行: {job_id}")
             return
-        
-        self.is_running = True
-        self.thread = threading.Thread(target=self._run_schedule, daemon=True)
-        self.thread.start()
+        try:
+            self._queue.put_nowait((job_id, is_coro, call))
+        except asyncio.QueueFull:
+            self.logger.warning(f"任务队列已满，跳过本次执行: {job_id}")
+        self._ensure_workers()
+    
+    def _fire_bucket(self, bucket: _Bucket):
+        """将分组内的所有任务放入执行队列，队列已满时丢弃"""
+        put_nowait = self._queue.put_nowait
+        for job_id, is_coro, call in zip(bucket.ids, bucket.coro_flags, bucket.calls):
+            try:
+                put_nowait((job_id, is_coro, call))
+            except asyncio.QueueFull:
+                self.logger.warning(f"任务队列已满，跳过本次执行: {job_id}")
+        self._ensure_workers()
+    
+    def _ensure_workers(self):
+        """队列中的任务多于空闲工作协程时补充工作协程，不超过并发上限"""
+        # 移除已退出的工作协程（如任务抛出 CancelledError 等异常），避免一直占用并发名额
+        self._workers = [task for task in self._workers if not task.done()]
+        missing = min(self._queue.qsize() - self._idle_workers,
+                      self.max_concurrency - len(self._workers))
+        for _ in range(missing):
+            task = self.loop.create_task(self._worker())
+            task.add_done_callback(self._log_task_exception)
+            self._workers.append(task)
+    
+    async def _worker(self):
+        """从队列中取出任务依次执行"""
+        queue = self._queue
+        run_in_executor = self.loop.run_in_executor
+        # 调度器停止或重启后退出
+        while queue is self._queue:
+            self._idle_workers += 1
+            try:
+                job_id, is_coro, call = await queue.get()
+            finally:
+                self._idle_workers -= 1
+            try:
+                if is_coro:
+                    await call()
+                else:
+                    # 同步函数放到线程池中执行，避免阻塞事件循环
+                    await run_in_executor(None, call)
+            except Exception as e:
+                self.logger.error(f"定时任务 {job_id} 执行失败: {e}", exc_info=e)
+            finally:
+                queue.task_done()
+    
+    def start(self):
+        """启动调度器，需要在事件循环中调用"""
+        with self._lifecycle_lock:
+            if self.is_running:
+                return
+            
+            if self.loop is None:
+                self.loop = asyncio.get_running_loop()
+            self.is_running = True
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            # 工作协程在有任务到期时才按需创建
+            self._workers = []
+            self._task = self.loop.create_task(self._run_async())
+            self._task.add_done_callback(self._log_task_exception)
+            
+            # 为指定时间执行的任务设置定时器，已过期的任务立即执行
+            for job_id in self._timed:
+                self._arm_timer(job_id)
         self.logger.info("任务调度器启动")
     
     def stop(self):
         """停止调度器"""
-        self.is_running = False
-        if self.thread:
-            self.thread.join()
+        with self._lifecycle_lock:
+            if not self.is_running:
+                return
+            
+            self.is_running = False
+            self._queue = None
+            tasks = [self._task, *self._workers]
+            self._task = None
+            self._workers = []
+            
+            # 取消定时器避免停止后继续唤醒事件循环，任务本身保留到下次 start()
+            for handle in self._timers.values():
+                handle.cancel()
+            self._timers.clear()
+        
+        # 由定时任务自身调用时不取消自己，让它执行完后自行退出
+        try:
+            current = asyncio.current_task()
+        except RuntimeError:
+            current = None
+        for task in tasks:
+            if task is not current:
+                task.cancel()
         self.logger.info("任务调度器停止")
     
-    def _run_schedule(self):
-        """运行调度循环"""
-        while self.is_running:
+    def _log_task_exception(self, task: asyncio.Task):
+        """调度协程或工作协程异常退出时记录错误"""
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            self.logger.error(f"调度器协程异常退出: {exc!r}", exc_info=exc)
+    
+    def stop_threadsafe(self):
+        """从其他线程停止调度器"""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.stop)
+    
+    async def _sleep(self, timeout: Optional[float]):
+        """休眠指定时间，被唤醒时提前返回；timeout 为 None 时一直等到被唤醒"""
+        if timeout is None:
+            await self._wake.wait()
+        else:
             try:
-                schedule.run_pending()
-                time.sleep(1)
-            except Exception as e:
-                self.logger.error(f"调度器运行错误: {e}")
-                time.sleep(5)
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wake.clear()
+    
+    async def _run_async(self):
+        """运行调度循环，休眠到堆顶任务到期或被唤醒"""
+        # 循环中用到的函数绑定为局部变量
+        heap = self._heap
+        get_bucket = self._buckets.get
+        heappop = heapq.heappop
+        heappush = heapq.heappush
+        monotonic = time.monotonic
+        fire_bucket = self._fire_bucket
+        sleep = self._sleep
+        lock = self._lock
+        while self.is_running:
+            with lock:
+                now = monotonic()
+                while heap and heap[0][0] <= now:
+                    _, seq, interval = heappop(heap)
+                    bucket = get_bucket(interval)
+                    if bucket is None or bucket.seq != seq:
+                        # 已清空或重建的分组
+                        self._stale -= 1
+                        continue
+                    heappush(heap, (now + interval, seq, interval))
+                    fire_bucket(bucket)
+                timeout = heap[0][0] - now if heap else None
+            
+            # 没有任务时不设超时，直到添加任务或停止时才被唤醒
+            await sleep(timeout)
@@ -0,0 +1,59 @@
+import asyncio
+import re
+import time
+
+# 优先使用 orjson 加速 JSON 读写，未安装时回退到标准库
+try:
+    import orjson
+
+    def json_dumps(obj) -> bytes:
+        """序列化为 UTF-8 编码的 JSON 字节串"""
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def json_dumps(obj) -> bytes:
+        """序列化为 UTF-8 编码的 JSON 字节串"""
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    json_loads = json.loads
+
+# 帖子链接中的主题 ID，兼容 thread-123、t123 和 tid=123 三种形式
+THREAD_ID_PATTERN = r'(?:/thread-|/t|[?&]tid=)(\d+)'
+THREAD_ID_RE = re.compile(THREAD_ID_PATTERN)
+
+
+class AsyncLimiter:
+    """异步漏桶限流器：time_period 秒内最多放行 max_rate 次"""
+    
+    def __init__(self, max_rate: float, time_period: float = 60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._rate_per_sec = max_rate / time_period
+        self._level = 0.0
+        self._last_check = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _leak(self):
+        """按经过的时间释放容量"""
+        now = time.monotonic()
+        self._level = max(0.0, self._level - (now - self._last_check) * self._rate_per_sec)
+        self._last_check = now
+    
+    async def acquire(self):
+        """等待直到有可用容量"""
+        async with self._lock:
+            self._leak()
+            while self._level + 1 > self.max_rate:
+                await asyncio.sleep((self._level + 1 - self.max_rate) / self._rate_per_sec)
+                self._leak()
+            self._level += 1
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        return None